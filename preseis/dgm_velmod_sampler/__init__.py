@@ -1 +1,2 @@
+from ._cache import load_models
 from .sample_dgm_velmod import sample_dgm_velmod
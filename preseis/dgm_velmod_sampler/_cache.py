@@ -0,0 +1,61 @@
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+
+import xarray as xr
+
+# chunks of a single unit, such that the units are interpolated in parallel by dask
+model_chunks = {"unit": 1, "kriging_type": 1, "summary_statistic": 1}
+
+# least recently used models, keyed by resolved paths; evicted models are closed to release their
+# file handles
+_models_maxsize = 4
+_models = OrderedDict()
+_models_lock = Lock()
+
+
+def load_models(dgm_path: Path, velmod_path: Path):
+    """
+    Open the DGM and VELMOD models as generated by the convert.py script, for `sample_dgm_velmod`.
+
+    The models are opened lazily, in chunks of a single unit, such that only the parts needed for
+    sampling are read.
+
+    Parameters
+    ----------
+    dgm_path, velmod_path : str or pathlib.Path
+        Locations of the DGM-5 and VELMOD-3.1 files
+
+    Returns
+    -------
+    dgm, velmod : xarray.Dataset
+        The models; the result is cached and shared between calls, so it should not be modified.
+        Only the most recently used models are kept open.
+
+    """
+    key = (Path(dgm_path).resolve(), Path(velmod_path).resolve())
+
+    with _models_lock:
+        if key in _models:
+            _models.move_to_end(key)
+            return _models[key]
+
+        models = _open_models(*key)
+        _models[key] = models
+        if len(_models) > _models_maxsize:
+            _, evicted = _models.popitem(last=False)
+            for ds in evicted:
+                ds.close()
+
+    return models
+
+
+def _open_models(dgm_path, velmod_path):
+    dgm, velmod = (
+        xr.open_dataset(
+            path, decode_coords="all", engine="h5netcdf", chunks=model_chunks
+        )
+        for path in (dgm_path, velmod_path)
+    )
+
+    return dgm, velmod
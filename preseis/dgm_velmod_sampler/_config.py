@@ -0,0 +1,48 @@
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping
+
+
+@dataclass(frozen=True)
+class Config:
+    download_directory: Path
+    output_directory: Path
+    velmod31_k_file: Path
+    downloads: Mapping[str, tuple]
+
+
+@lru_cache
+def load_config(root: Path) -> Config:
+    """
+    Read the package configuration, as used by the `configure.py` and `convert.py` scripts.
+
+    Parameters
+    ----------
+    root : pathlib.Path
+        Location of the distribution, containing the `config/config.json` configuration file.
+        Relative paths in the configuration are relative to this location.
+
+    Returns
+    -------
+    Config
+        Configuration with all paths resolved; the result is cached and shared between calls
+
+    """
+    with open(root / "config/config.json", "r") as f:
+        config = json.load(f)
+
+    def resolve(path):
+        path = Path(path)
+        return path if path.is_absolute() else root / path
+
+    return Config(
+        download_directory=resolve(config["download_directory"]),
+        output_directory=resolve(config["output_directory"]),
+        velmod31_k_file=resolve(config["velmod31_k_file"]),
+        downloads=MappingProxyType(
+            {ds: tuple(urls) for ds, urls in config["downloads"].items()}
+        ),
+    )
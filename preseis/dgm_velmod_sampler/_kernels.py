@@ -0,0 +1,62 @@
+import numpy as np
+from numba import njit, prange
+
+# fast-math flags without "nnan" and "ninf": the interpolated DGM depths contain NaN (outside the
+# model) and -inf (bottom of the deepest unit), which must compare as IEEE floats
+_fastmath = {"nsz", "arcp", "contract", "afn", "reassoc"}
+
+
+@njit(parallel=True, fastmath=_fastmath, cache=True)
+def compute_vinst(tvd, V0, k, z, out_vinst, out_unit):
+    """
+    Compute the instantaneous velocity Vinst = V0 - k * z of the unit present at each depth.
+
+    The unit present at depth `z` is the first unit (top to bottom) of which the top lies above `z`.
+    If no such unit exists, the first unit is used. Missing velocities are reported as 0.0.
+
+    Parameters
+    ----------
+    tvd, V0, k : numpy.ndarray
+        Arrays of shape (U, P) with the depth of the top, V0 and k of U units (sorted top to
+        bottom) at P points
+    z : numpy.ndarray
+        Array of shape (Z, P) with the depths at each point
+    out_vinst : numpy.ndarray
+        Output array of shape (Z, P) for the instantaneous velocities
+    out_unit : numpy.ndarray
+        Output array of shape (Z, P) for the index of the unit present
+
+    """
+    U, P = tvd.shape
+    Z = z.shape[0]
+    for p in prange(P):
+        # columns without missing units have non-increasing tops, which allows a binary search
+        sorted_column = not np.isnan(tvd[0, p])
+        for u in range(1, U):
+            if not tvd[u, p] <= tvd[u - 1, p]:
+                sorted_column = False
+                break
+
+        for iz in range(Z):
+            zp = z[iz, p]
+            u_sel = 0
+            if sorted_column:
+                lo, hi = 0, U
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if tvd[mid, p] < zp:
+                        hi = mid
+                    else:
+                        lo = mid + 1
+                if lo < U:
+                    u_sel = lo
+            else:
+                for u in range(U):
+                    if tvd[u, p] < zp:
+                        u_sel = u
+                        break
+            vinst = V0[u_sel, p] - k[u_sel, p] * zp
+            if np.isnan(vinst):
+                vinst = 0.0
+            out_vinst[iz, p] = vinst
+            out_unit[iz, p] = u_sel
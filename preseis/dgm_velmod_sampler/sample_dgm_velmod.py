@@ -2,6 +2,8 @@ import numpy as np
 import rioxarray
 import xarray as xr
 
+from ._kernels import compute_vinst
+
 
 def sample_dgm_velmod(
     x, y, z, dgm: xr.Dataset, velmod: xr.Dataset, crs=None
@@ -32,7 +34,10 @@ def sample_dgm_velmod(
         Represents the DGM-5 model as generated by the convert.py script
 
     velmod: xarray.Dataset
-        Represents the VELMOD-3.1 model as generated by the convert.py script
+        Represents the VELMOD-3.1 model as generated by the convert.py script. Models opened lazily
+        in chunks of a single unit, e.g. with `xr.open_dataset(..., engine="h5netcdf",
+        chunks={"unit": 1, "kriging_type": 1, "summary_statistic": 1})`, are interpolated unit by
+        unit in parallel threads
 
     crs: Any, Optional
         A coordinate reference system (CRS) specifier accepted by rioxarray. Represent the CRS for the
@@ -51,54 +56,80 @@ def sample_dgm_velmod(
         dgm.rio.crs == velmod.rio.crs
     ), "coordinate reference systems of dgm and velmod do not match"
 
-    # determine which units are common to both datasets
-    sel_units = np.intersect1d(dgm["unit"], velmod["unit"])
+    # determine which units are common to both datasets, as stored by the convert.py script
+    # the attribute survives subsetting a model, so only the units still present are used
+    common_units = velmod.attrs.get("common_units")
+    if common_units is not None and np.array_equal(
+        common_units, dgm.attrs.get("common_units")
+    ):
+        sel_units = [
+            u
+            for u in np.atleast_1d(common_units)
+            if u in dgm.indexes["unit"] and u in velmod.indexes["unit"]
+        ]
+    else:
+        sel_units = np.intersect1d(dgm["unit"], velmod["unit"])
 
-    # interpolate VELMOD
-    velmod_itp = (
-        velmod.sel({"unit": sel_units}).interp({"x": x, "y": y}).sortby("ordering")
-    )
+    velmod = _select_units(velmod, sel_units)
+    dgm = _select_units(dgm, sel_units)
+    assert dgm["unit"].equals(velmod["unit"]), "units of dgm and velmod do not match"
+
+    # assert the units are sorted top to bottom, as stored by the convert.py script
+    for ds in (dgm, velmod):
+        assert (
+            np.diff(ds["ordering"].values) > 0
+        ).all(), "units of dgm and velmod are not sorted by ordering"
 
-    # interpolate DGM
-    dgm_itp = dgm.sel({"unit": sel_units}).interp({"x": x, "y": y}).sortby("ordering")
+    # determine the interpolation weights, once for both models if their grids match
+    velmod_weights = _bilinear_weights(velmod, x, y)
+    if velmod["x"].equals(dgm["x"]) and velmod["y"].equals(dgm["y"]):
+        dgm_weights = velmod_weights
+    else:
+        dgm_weights = _bilinear_weights(dgm, x, y)
 
     # generate combined velocity grid
     # for this only simply kriging is available ("sk")
-    V0 = velmod_itp["V0_filled"].sel(
-        {"summary_statistic": "mean", "kriging_type": "sk"}, drop=True
-    )
-    SD = velmod_itp["V0_filled"].sel(
-        {"summary_statistic": "sd", "kriging_type": "sk"}, drop=True
+    V0_filled = _bilinear_batched(
+        velmod["V0_filled"].sel({"kriging_type": "sk"}, drop=True), velmod_weights
     )
+    V0 = V0_filled.sel({"summary_statistic": "mean"}, drop=True)
+    SD = V0_filled.sel({"summary_statistic": "sd"}, drop=True)
+    tvd = _bilinear_batched(dgm["tvd"], dgm_weights)
 
     dgm_velmod_samples = xr.Dataset(
         {
             "V0": V0,
             "V0_sd": SD,
-            "k": velmod_itp["k"],
-            "depth": dgm_itp["tvd"],
-            "ordering": dgm_itp["ordering"],
+            "k": velmod["k"],
+            "depth": tvd,
+            "ordering": dgm["ordering"],
         }
-    )
+    ).compute()  # models opened in chunks of a unit are interpolated in parallel by dask
 
-    # create full depth grids for all units
-    # note that this is not super efficient since only a limited section will
-    # be used in the final result
-    # Vinst = V0 + k * z
+    # Vinst = V0 + k * z, evaluated only for the unit present at each depth
     if z is not None:
-        # create depth profiles for each unit
-        unit_vinst = V0 - velmod_itp["k"] * z
+        if not isinstance(z, xr.DataArray):
+            z = xr.DataArray(z)  # e.g. a single depth
 
-        # determine which unit is present at which depth
-        unit = (dgm_itp["tvd"] < z).idxmax("unit")
-        dgm_velmod_samples["unit_samples"] = unit
+        Vinst, unit_idx = _vinst(
+            dgm_velmod_samples["depth"],
+            dgm_velmod_samples["V0"],
+            dgm_velmod_samples["k"],
+            z,
+        )
+        dgm_velmod_samples["unit_samples"] = unit_idx.copy(
+            data=dgm["unit"].values[unit_idx.values]
+        )
 
         # create corresponding mask
-        unit_mask = unit_vinst["unit"] == unit
-        dgm_velmod_samples["unit_mask"] = unit_mask
+        unit_number = xr.DataArray(
+            np.arange(dgm.sizes["unit"]),
+            dims="unit",
+            coords={"unit": dgm["unit"]},
+        )
+        dgm_velmod_samples["unit_mask"] = unit_number == unit_idx
 
-        # and combine both
-        dgm_velmod_samples["Vinst"] = unit_vinst.where(unit_mask, 0.0).sum("unit")
+        dgm_velmod_samples["Vinst"] = Vinst
 
     # check if the CRS is stored in the inputs already
     if not crs:
@@ -112,3 +143,204 @@ def sample_dgm_velmod(
         dgm_velmod_samples.rio.write_coordinate_system(inplace=True)
 
     return dgm_velmod_samples
+
+
+def _select_units(ds: xr.Dataset, units) -> xr.Dataset:
+    # select by position, which preserves the (sorted) order of the units
+    mask = ds["unit"].isin(units).values
+    if mask.all():
+        return ds
+
+    return ds.isel({"unit": mask})
+
+
+def _bilinear_weights(ds: xr.Dataset, x, y):
+    """
+    Determine the weights for bilinear interpolation of the (`x`,`y`) grid of `ds` at the requested
+    sample locations, equivalent to the linear interpolation of `xarray.Dataset.interp`.
+
+    When `x` and `y` share their dimensions (e.g. a curvilinear grid of UTM coordinates indexed by
+    RD grid coordinates, as in `tests/test_sampling.py`, where `x_UTM` and `y_UTM` both have
+    dimensions ("x", "y")), every sample location is a single (x, y) point. Otherwise, the samples
+    form the (orthogonal) grid of all combinations of `x` and `y`.
+
+    Both cases are interpolated as xarray does for shared dimensions (scipy's
+    RegularGridInterpolator). For orthogonal samples this differs from `xarray.Dataset.interp`, which
+    interpolates one dimension after the other and turns the -inf bottom of DGM into NaN, such that
+    the deepest unit was never found present; it is now, as for shared dimensions.
+
+    Parameters
+    ----------
+    ds : xarray.Dataset
+        Dataset with "x" and "y" grid dimensions
+    x, y : array_like
+        Spatial coordinates of the sample locations, see `sample_dgm_velmod`
+
+    Returns
+    -------
+    tuple
+        The (x, y) grid indices of the four corners of the grid cell surrounding each sample location
+        with their weights, and the dimensions and coordinates of the samples
+
+    """
+    x, y = (
+        v if isinstance(v, xr.DataArray) else _as_coordinate(v, ds[dim])
+        for v, dim in ((x, "x"), (y, "y"))
+    )
+
+    # as xarray, the sample dimensions replace the grid dimensions in place for orthogonal
+    # samples, and are put in place of the first grid dimension otherwise
+    if set(x.dims).isdisjoint(y.dims):
+        corners = _separable_corners(ds, x, y)
+        sample_dims = {"x": x.dims, "y": y.dims}
+    else:
+        xs, ys = xr.broadcast(x, y)
+        ix, tx = _linear_weights(ds["x"].values, xs.values)
+        iy, ty = _linear_weights(ds["y"].values, ys.values)
+
+        corners = []
+        for dx, wx in ((0, 1.0 - tx), (1, tx)):
+            for dy, wy in ((0, 1.0 - ty), (1, ty)):
+                indexers = {
+                    "x": xr.Variable(xs.dims, ix + dx),
+                    "y": xr.Variable(xs.dims, iy + dy),
+                }
+                corners.append((indexers, xr.Variable(xs.dims, wx * wy)))
+
+        sample_dims = {"x": xs.dims, "y": ()}
+
+    # the sample locations become coordinates, unless they come with their own
+    coords = {"x": x.variable, "y": y.variable}
+    coords.update(x.coords)
+    coords.update(y.coords)
+
+    return corners, sample_dims, coords
+
+
+def _separable_corners(ds: xr.Dataset, x: xr.DataArray, y: xr.DataArray):
+    # Orthogonal samples only need the weights along each axis. The corner indexers keep their own
+    # dimensions, such that the grid is gathered by (cheap) outer indexing of the rows and columns
+    # needed, rather than by point-wise indexing of every combination of `x` and `y`.
+    ix, tx = _linear_weights(ds["x"].values, x.values)
+    iy, ty = _linear_weights(ds["y"].values, y.values)
+
+    corners = []
+    for dx, wx in ((0, 1.0 - tx), (1, tx)):
+        for dy, wy in ((0, 1.0 - ty), (1, ty)):
+            indexers = {
+                "x": xr.Variable(x.dims, ix + dx),
+                "y": xr.Variable(y.dims, iy + dy),
+            }
+            w = xr.Variable(x.dims, wx) * xr.Variable(y.dims, wy)
+            corners.append((indexers, w))
+
+    return corners
+
+
+def _as_coordinate(v, grid):
+    # plain 1-D arrays replace the grid coordinate, like in `xarray.Dataset.interp`
+    v = np.asarray(v)
+    if v.ndim == 1:
+        dim = grid.name
+        return xr.DataArray(v, dims=dim, coords={dim: (dim, v, grid.attrs)})
+
+    return xr.DataArray(v, attrs=grid.attrs)
+
+
+def _linear_weights(grid, v):
+    # Indices i and fractions t, such that v = (1 - t) * grid[i] + t * grid[i + 1], as determined by
+    # scipy's RegularGridInterpolator. Locations outside the grid have fraction NaN.
+    descending = grid[0] > grid[-1]
+    if descending:
+        grid = grid[::-1]
+
+    i = np.clip(np.searchsorted(grid, v) - 1, 0, grid.size - 2)
+    t = (v - grid[i]) / (grid[i + 1] - grid[i])
+    t = np.where((v < grid[0]) | (v > grid[-1]), np.nan, t)
+
+    if descending:
+        i, t = grid.size - 2 - i, 1.0 - t
+
+    return i, t
+
+
+def _bilinear_batched(da: xr.DataArray, weights) -> xr.DataArray:
+    """
+    Interpolate the (`x`,`y`) grid of `da` with pre-computed bilinear interpolation weights.
+
+    Parameters
+    ----------
+    da : xarray.DataArray
+        Data with "x" and "y" grid dimensions
+    weights : tuple
+        Interpolation weights as determined by `_bilinear_weights`
+
+    Returns
+    -------
+    xarray.DataArray
+        Interpolated data
+
+    """
+    corners, sample_dims, coords = weights
+
+    # as scipy, all four corners contribute, such that missing values propagate
+    da = da.drop_vars([c for c in ("x", "y") if c in da.coords])
+    da_itp = sum(da.isel(indexers) * w for indexers, w in corners)
+
+    dims = []
+    for dim in da.dims:
+        dims.extend(sample_dims.get(dim, (dim,)))
+
+    return da_itp.transpose(*dims).assign_coords(coords)
+
+
+def _vinst(tvd: xr.DataArray, V0: xr.DataArray, k: xr.DataArray, z):
+    """
+    Determine the unit present at depths `z` and its instantaneous velocity.
+
+    Parameters
+    ----------
+    tvd, V0, k : xarray.DataArray
+        Depth of the top, V0 and k of the units, sorted top to bottom along the "unit" dimension
+    z : xarray.DataArray
+        Vertical locations, see `sample_dgm_velmod`
+
+    Returns
+    -------
+    Vinst, unit_idx : xarray.DataArray
+        Instantaneous velocity and index along the "unit" dimension of the unit present
+
+    """
+    point_dims = [dim for dim in tvd.dims if dim != "unit"]
+    template = xr.broadcast(z, tvd.isel({"unit": 0}, drop=True))[0]
+    z_dims = [dim for dim in template.dims if dim not in point_dims]
+    template = template.transpose(*z_dims, *point_dims)
+
+    def unit_points(da):
+        values = da.broadcast_like(tvd).transpose("unit", *point_dims).values
+        return np.ascontiguousarray(values).reshape(tvd.sizes["unit"], -1)
+
+    tvd_v, V0_v, k_v = unit_points(tvd), unit_points(V0), unit_points(k)
+    z_v = template.values.reshape(-1, tvd_v.shape[1])
+
+    Vinst = np.empty(z_v.shape)
+    unit_idx = np.empty(z_v.shape, dtype=np.intp)
+    compute_vinst(tvd_v, V0_v, k_v, z_v, Vinst, unit_idx)
+
+    def to_xarray(values, dims):
+        da = xr.DataArray(
+            values.reshape(template.shape),
+            dims=template.dims,
+            coords=template.coords,
+        )
+        return da.transpose(*dims)
+
+    # as for V0 - k * z and tvd < z respectively; for the latter xarray puts the dimensions of `z`
+    # first when it is an index coordinate (e.g. `grid["z"]`), as determined on empty slices
+    def empty(da):
+        return da.isel({dim: slice(0, 0) for dim in da.dims})
+
+    above_dims = (empty(tvd) < empty(z)).dims
+    unit_dims = [dim for dim in above_dims if dim != "unit"]
+
+    return to_xarray(Vinst, (*point_dims, *z_dims)), to_xarray(unit_idx, unit_dims)
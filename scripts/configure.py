@@ -6,40 +6,53 @@ The file URL's are supplied in the `config.json` file included in the distributi
 
 """
 
-import json5
-import wget
+import httpx
+import sys
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import urlparse
+from tqdm import tqdm
 
+module_path = Path(__file__).parent.parent
+sys.path.insert(0, str(module_path / "preseis"))
+
+from dgm_velmod_sampler._config import load_config
 
-def configure(verbose=False):
-    module_path = Path(__file__).parent.parent
-    config_path = module_path / "config/config.json"
-    with open(config_path, "r") as f:
-        config = json5.load(f)
 
-    downloads = Path(config["download_directory"])
-    if not downloads.is_absolute():
-        downloads = module_path / downloads
+def configure(verbose=False):
+    config = load_config(module_path)
+    downloads = config.download_directory
 
     if verbose:
         print("download model files")
     filelist = []
-    for ds, files in config["downloads"].items():
+    pending = []
+    for ds, files in config.downloads.items():
         folder = downloads / ds
         folder.mkdir(parents=True, exist_ok=True)
         assert folder.is_dir()
         for url in files:
-            filename = folder / wget.detect_filename(url)
+            filename = folder / Path(urlparse(url).path).name
             if filename.exists():
                 if verbose:
                     print(f"    file {filename} exists .. skipped")
             else:
-                if verbose:
-                    print(f"    downloading {filename}")
-                wget.download(url, str(folder))
+                pending.append((url, filename))
             filelist.append(filename)
 
+    # downloads are I/O bound, so run them concurrently over a shared (HTTP/2) client
+    # the files are large, but a stalled connection should not hang forever
+    timeout = httpx.Timeout(30.0, read=120.0)
+    with httpx.Client(http2=True, follow_redirects=True, timeout=timeout) as client:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [
+                executor.submit(download, client, url, filename, verbose, position)
+                for position, (url, filename) in enumerate(pending)
+            ]
+            for future in futures:
+                future.result()
+
     if verbose:
         print("extract ZMAP files")
     for zipf in filelist:
@@ -58,5 +71,46 @@ def configure(verbose=False):
                         z.extract(f, path=folder)
 
 
+def download(client, url, filename, verbose=False, position=None):
+    # download to a partial file first, such that an interrupted download is resumed
+    # rather than mistaken for a complete file
+    part = filename.with_name(filename.name + ".part")
+    offset = part.stat().st_size if part.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    with client.stream("GET", url, headers=headers) as response:
+        if offset and response.status_code == 416:
+            # no range left to download: the partial file is complete (e.g. interrupted
+            # before renaming) only if it matches the remote size in "bytes */<size>"
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            complete = total == str(offset)
+        else:
+            response.raise_for_status()
+            if response.status_code != 206:
+                offset = 0
+            # the range and content length refer to the bytes as sent, so write them undecoded
+            size = int(response.headers.get("Content-Length", 0))
+            progress = tqdm(
+                desc=f"    downloading {filename.name}",
+                total=offset + size or None,
+                initial=offset,
+                unit="B",
+                unit_scale=True,
+                position=position,
+                disable=not verbose,
+            )
+            with open(part, "ab" if offset else "wb") as f, progress:
+                for chunk in response.iter_raw():
+                    f.write(chunk)
+                    progress.update(len(chunk))
+            complete = True
+
+    if not complete:
+        # the partial file does not belong to the remote file, start over
+        part.unlink()
+        return download(client, url, filename, verbose, position)
+    part.rename(filename)
+
+
 if __name__ == "__main__":
     configure(verbose=True)
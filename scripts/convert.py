@@ -9,36 +9,63 @@ accesibly after running the `configure.py` script."
 """
 
 import math
-import json5
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
 from pathlib import Path
+import numpy as np
 import xarray as xr
 import pandas as pd
 from tqdm import tqdm
 import zmapio  # https://pypi.org/project/zmapio/
 import rioxarray  # provide rio accessor to xarray for georeferencing
 
-# we use the UTM version of DGM and VELMOD as it appears to be the original and most consistent
-crs_UTM31 = "epsg:23031"  # https://epsg.io/23031
+module_path = Path(__file__).parent.parent
+sys.path.insert(0, str(module_path / "preseis"))
 
+from dgm_velmod_sampler._config import load_config
 
-def convert(verbose=False):
-    module_path = Path(__file__).parent.parent
-    base_path = module_path
+# we use the UTM version of DGM and VELMOD as it appears to be the original and most consistent
+crs_UTM31 = "epsg:23031"  # https://epsg.io/23031
 
-    config_path = module_path / "config/config.json"
-    with open(config_path, "r") as f:
-        config = json5.load(f)
+# maps are stored in compressed (y, x) tiles of ~1 MB (float32), one unit/statistic per chunk,
+# such that sampling a small area only reads and decompresses the tiles it needs
+chunk_tile = {"y": 512, "x": 512}
+
+# hard code ordering of units
+unit_canonical_order = [
+    "N",
+    "NU",
+    "NLNM",
+    "NM",
+    "NL",
+    "CK",
+    "KN",
+    "KNG",
+    "KNGL",
+    "KNN",
+    "S",
+    "SL",
+    "SG",
+    "SK",
+    "ATPO",
+    "AT",
+    "TR",
+    "RN",
+    "RB",
+    "ZE",
+    "RO",
+    "DCC",
+    "DC",
+    "CL",
+]
 
-    out_path = Path(config["output_directory"])
-    download_path = Path(config["download_directory"])
-    velmod31_k_file = Path(config["velmod31_k_file"])
 
-    if not download_path.is_absolute():
-        download_path = base_path / download_path
-    if not out_path.is_absolute():
-        out_path = base_path / out_path
-    if not velmod31_k_file.is_absolute():
-        velmod31_k_file = base_path / velmod31_k_file
+def convert(verbose=False):
+    config = load_config(module_path)
+    out_path = config.output_directory
+    download_path = config.download_directory
+    velmod31_k_file = config.velmod31_k_file
 
     out_path.mkdir(parents=True, exist_ok=True)
     out_velmod = out_path / "VELMOD31_UTM31.h5"
@@ -47,34 +74,6 @@ def convert(verbose=False):
     velmod_zmap_list = list(download_path.glob("velmod31/**/*.dat"))
     dgm_zmap_list = list(download_path.glob("dgmdeep5/**/*tvd*merge_*UTM31.zmap"))
 
-    # hard code ordering of units
-    unit_canonical_order = [
-        "N",
-        "NU",
-        "NLNM",
-        "NM",
-        "NL",
-        "CK",
-        "KN",
-        "KNG",
-        "KNGL",
-        "KNN",
-        "S",
-        "SL",
-        "SG",
-        "SK",
-        "ATPO",
-        "AT",
-        "TR",
-        "RN",
-        "RB",
-        "ZE",
-        "RO",
-        "DCC",
-        "DC",
-        "CL",
-    ]
-
     # VELMOD3.1
     print("converting VELMOD3.1 to h5")
 
@@ -82,15 +81,12 @@ def convert(verbose=False):
     velmoddata = xr.Dataset(pd.read_csv(velmod31_k_file, delimiter=";", index_col=1))
 
     # select and read all data files
-    velmodds = [velmod_zmap_to_xarray(zm, crs_UTM31) for zm in tqdm(velmod_zmap_list)]
+    velmod_labels = [velmod_zmap_labels(zm) for zm in velmod_zmap_list]
+    velmodds = read_zmaps(velmod_zmap_list)
 
-    # concatenate individual files
+    # combine individual files
     velmodxrc = (
-        xr.concat(velmodds, "u_v_k_s")
-        .set_index(
-            {"u_v_k_s": ["unit", "variable", "kriging_type", "summary_statistic"]}
-        )
-        .unstack()
+        zmaps_to_xarray(velmodds, velmod_labels, crs_UTM31, "VELMOD3.1")
         .dropna("x", "all")
         .dropna("y", "all")
     )
@@ -99,9 +95,7 @@ def convert(verbose=False):
     velmodxrds = xr.merge([velmodxrc.to_dataset("variable"), velmoddata])
 
     # add canonical ordering (top to bottom) and sort accordingly
-    ordering = xr.zeros_like(velmodxrds["unit"], dtype=int).rename("ordering")
-    for u in ordering.coords["unit"]:
-        ordering.loc[{"unit": u}] = unit_canonical_order.index(u)
+    ordering = canonical_ordering(velmodxrds["unit"])
     velmod_UTM = xr.merge((velmodxrds, ordering)).sortby("ordering")
 
     # integrate ZE in the Vinst=V0+k*z template by setting V0=Vint and utlizing k=0 for ZE set above
@@ -114,26 +108,19 @@ def convert(verbose=False):
     # However, this information should come from the VELMOD development team
     velmod_UTM["V0_filled"] = velmod_UTM["V0"].fillna(velmod_UTM["V0"].mean(["x", "y"]))
 
-    # write to disk
-    velmod_UTM.to_netcdf(out_velmod, mode="w")
-    if verbose:
-        print(f"wrote: {out_velmod.absolute()}")
-
     # DGM5
     print("converting DGM5 to h5")
 
-    dgmds = [dgm_zmap_to_xarray(zm, crs_UTM31) for zm in tqdm(dgm_zmap_list)]
+    dgm_labels = [dgm_zmap_labels(zm) for zm in dgm_zmap_list]
+    dgmds = read_zmaps(dgm_zmap_list)
 
     # add bottom to DC at -infinity for convenience
-    last = xr.full_like(dgmds[0], -math.inf)
-    last["unit"] = "DC"
-    dgmds.append(last)
+    dgm_labels.append({**dgm_labels[0], "unit": "DC"})
+    dgmds.append(xr.full_like(dgmds[0], -math.inf))
 
-    # concatenate individual files
+    # combine individual files
     dgmxrc = (
-        xr.concat(dgmds, "unit_var")
-        .set_index({"unit_var": ["unit", "var"]})
-        .unstack()
+        zmaps_to_xarray(dgmds, dgm_labels, crs_UTM31, "DGM5")
         .dropna("x", "all")
         .dropna("y", "all")
     )
@@ -142,40 +129,118 @@ def convert(verbose=False):
     dgmxrds = dgmxrc.to_dataset("var")
 
     # add canonical ordering (top to bottom) and sort accordingly
-    dgm_ordering = xr.zeros_like(dgmxrds["unit"], dtype=int).rename("ordering")
-    for u in dgm_ordering.coords["unit"]:
-        dgm_ordering.loc[{"unit": u}] = unit_canonical_order.index(u)
+    dgm_ordering = canonical_ordering(dgmxrds["unit"])
     dgm_UTM = xr.merge([dgmxrds, dgm_ordering]).sortby("ordering")
 
-    dgm_UTM.to_netcdf(out_dgm, mode="w")
+    # store the units common to both models (in canonical order), such that sampling does not
+    # need to determine and select them
+    common_units = [
+        u
+        for u in unit_canonical_order
+        if u in dgm_UTM.indexes["unit"] and u in velmod_UTM.indexes["unit"]
+    ]
+    velmod_UTM.attrs["common_units"] = common_units
+    dgm_UTM.attrs["common_units"] = common_units
+
+    # write to disk
+    velmod_UTM.to_netcdf(
+        out_velmod, mode="w", engine="h5netcdf", encoding=netcdf_encoding(velmod_UTM)
+    )
+    if verbose:
+        print(f"wrote: {out_velmod.absolute()}")
+
+    dgm_UTM.to_netcdf(
+        out_dgm, mode="w", engine="h5netcdf", encoding=netcdf_encoding(dgm_UTM)
+    )
     if verbose:
         print(f"wrote: {out_dgm.absolute()}")
 
 
-def dgm_zmap_to_xarray(zmap_file, crs):
-    name = zmap_file.stem
-    name_list = name.split("_")
-    unit = name_list[0]
-    var = name_list[1]
+def canonical_ordering(units):
+    codes = pd.Categorical(
+        units.values, categories=unit_canonical_order, ordered=True
+    ).codes
+    assert (codes >= 0).all(), "units missing from the canonical ordering"
+
+    return xr.DataArray(
+        codes.astype(int), dims="unit", coords={"unit": units}, name="ordering"
+    )
+
 
+def netcdf_encoding(ds):
+    encoding = {}
+    for name, var in ds.data_vars.items():
+        if var.dtype.kind != "f":
+            continue
+
+        # the models have at best 3-4 significant digits, single precision suffices
+        encoding[name] = {
+            **var.encoding,  # e.g. grid_mapping as set by rioxarray
+            "dtype": "float32",
+        }
+        if {"x", "y"}.issubset(var.dims):
+            encoding[name].update(
+                {
+                    "chunksizes": tuple(
+                        min(chunk_tile.get(d, 1), var.sizes[d]) for d in var.dims
+                    ),
+                    "zlib": True,
+                    "complevel": 1,
+                    "shuffle": True,
+                }
+            )
+
+    return encoding
+
+
+def read_zmap(zmap_file):
     zm = zmapio.ZMAPGrid(zmap_file.as_posix())
 
-    zmds = xr.Dataset.from_dataframe(zm.to_pandas())
-    zmda = zmds.set_index({"index": ["X", "Y"]}).unstack()["Z"].T
+    # pivot the (X, Y, Z) points to a (y, x) grid
+    zmdf = zm.to_pandas().pivot(index="Y", columns="X", values="Z")
+    zmda = xr.DataArray(
+        zmdf.values,
+        dims=("y", "x"),
+        coords={"y": zmdf.index.values, "x": zmdf.columns.values},
+        name="Z",
+    )
+
+    return zmda
+
+
+def read_zmaps(zmap_list):
+    # parsing is CPU bound, so the files are spread over processes
+    with ProcessPoolExecutor() as executor:
+        return list(tqdm(executor.map(read_zmap, zmap_list), total=len(zmap_list)))
+
+
+def zmaps_to_xarray(zmdas, labels, crs, model):
+    # all labels and the combined (y, x) grid of the individual files
+    dims = list(labels[0])
+    coords = {dim: sorted({label[dim] for label in labels}) for dim in dims}
+    index = {dim: {c: i for i, c in enumerate(coords[dim])} for dim in dims}
+    y = reduce(np.union1d, (zmda["y"].values for zmda in zmdas))
+    x = reduce(np.union1d, (zmda["x"].values for zmda in zmdas))
+
+    # write the files into a pre-allocated array, combinations without file remain missing
+    data = np.full((y.size, x.size, *(len(c) for c in coords.values())), np.nan)
+    for zmda, label in zip(zmdas, labels):
+        iy = np.searchsorted(y, zmda["y"].values)
+        ix = np.searchsorted(x, zmda["x"].values)
+        data[(iy[:, None], ix, *(index[dim][label[dim]] for dim in dims))] = zmda.values
+
     zmda = (
-        zmda.expand_dims("unit_var")
-        .assign_coords(
-            {
-                "unit": ("unit_var", [unit]),
-                "var": ("unit_var", [var.strip("_")]),
-            }
+        xr.DataArray(
+            data,
+            dims=("y", "x", *dims),
+            coords={"y": y, "x": x, **coords},
+            name="Z",
         )
-        .rename({"X": "x", "Y": "y"})
         .rio.write_crs(crs)
         .rio.write_coordinate_system()
         .assign_attrs(
             {
-                "model": "DGM5",
+                "model": model,
             }
         )
     )
@@ -183,7 +248,16 @@ def dgm_zmap_to_xarray(zmap_file, crs):
     return zmda
 
 
-def velmod_zmap_to_xarray(zmap_file, crs):
+def dgm_zmap_labels(zmap_file):
+    name = zmap_file.stem
+    name_list = name.split("_")
+    unit = name_list[0]
+    var = name_list[1]
+
+    return {"unit": unit, "var": var.strip("_")}
+
+
+def velmod_zmap_labels(zmap_file):
     name = zmap_file.stem.replace("NLM", "NLNM")  # tidying up
     # add suffix for mean, to distinguish from sd
     # the suffix is subsequently dropped for sd by selecting [0:5]
@@ -194,31 +268,12 @@ def velmod_zmap_to_xarray(zmap_file, crs):
     kriging_type = name_list[3]
     summary_statistic = name_list[4]
 
-    zm = zmapio.ZMAPGrid(zmap_file.as_posix())
-
-    zmds = xr.Dataset.from_dataframe(zm.to_pandas())
-    zmda = zmds.set_index({"index": ["X", "Y"]}).unstack()["Z"].T
-    zmda = (
-        zmda.expand_dims("u_v_k_s")
-        .assign_coords(
-            {
-                "unit": ("u_v_k_s", [unit]),
-                "variable": ("u_v_k_s", [var]),
-                "kriging_type": ("u_v_k_s", [kriging_type]),
-                "summary_statistic": ("u_v_k_s", [summary_statistic]),
-            }
-        )
-        .rename({"X": "x", "Y": "y"})
-        .rio.write_crs(crs)
-        .rio.write_coordinate_system()
-        .assign_attrs(
-            {
-                "model": "VELMOD3.1",
-            }
-        )
-    )
-
-    return zmda
+    return {
+        "unit": unit,
+        "variable": var,
+        "kriging_type": kriging_type,
+        "summary_statistic": summary_statistic,
+    }
 
 
 if __name__ == "__main__":
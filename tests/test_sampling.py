@@ -1,5 +1,6 @@
 from pathlib import Path
 import numpy as np
+import pytest
 import xarray as xr
 import pyproj as prj
 import sys
@@ -7,8 +8,9 @@ import sys
 test_path = Path(__file__).parent
 module_path = test_path.parent
 sys.path.insert(0, str(module_path))
+sys.path.insert(0, str(module_path / "preseis"))
 
-from dgm_velmod_sampler import sample_dgm_velmod
+from dgm_velmod_sampler import load_models, sample_dgm_velmod
 
 sample_path = test_path / "res/sample.h5"
 velmod_path = test_path / "res/VELMOD31_UTM31.h5"
@@ -19,15 +21,16 @@ def test_config_file_exists():
     assert (module_path / "config/config.json").exists() == True
 
 
-def test_sampling(create=False):
+@pytest.fixture(scope="session")
+def models():
     assert velmod_path.exists()
     assert dgm_path.exists()
-    if not create:
-        assert sample_path.exists()
 
-    velmod = xr.load_dataset(velmod_path, decode_coords="all")
-    dgm = xr.load_dataset(dgm_path, decode_coords="all")
+    # opened once for all tests
+    return load_models(dgm_path, velmod_path)
+
 
+def sampling_grid():
     crs_UTM, crs_RD = (
         prj.CRS("EPSG:23031"),
         prj.CRS("EPSG:28992"),
@@ -48,21 +51,169 @@ def test_sampling(create=False):
     )
 
     # Determine UTM coordinates for all grid points
+    # prj Transformers do not broadcast, but transform full arrays in a single call
     x_UTM, y_UTM = xr.apply_ufunc(
         RD_to_UTM.transform,
-        grid["x"],
-        grid["y"],
+        *xr.broadcast(grid["x"], grid["y"]),
         output_core_dims=[[], []],
-        vectorize=True,  # prj Transformers do not broadcast
         keep_attrs=True,
     )
 
+    return x_UTM, y_UTM, grid["z"]
+
+
+def test_sampling(models, create=False):
+    # regenerate the stored sample with:
+    # test_sampling(load_models(dgm_path, velmod_path), create=True)
+    if not create:
+        assert sample_path.exists()
+
+    dgm, velmod = models
+    x_UTM, y_UTM, z = sampling_grid()
+
     # Sample models to cube, no need to pass CRS since it is represented in the x_UTM data structure
-    dgm_velmod_cube = sample_dgm_velmod(x_UTM, y_UTM, grid["z"], dgm=dgm, velmod=velmod)
+    dgm_velmod_cube = sample_dgm_velmod(x_UTM, y_UTM, z, dgm=dgm, velmod=velmod)
 
     if create:
-        dgm_velmod_cube.to_netcdf(sample_path, mode="w")
+        dgm_velmod_cube.to_netcdf(sample_path, mode="w", engine="h5netcdf")
+
+    sample = xr.load_dataset(sample_path, decode_coords="all", engine="h5netcdf")
+
+    xr.testing.assert_allclose(dgm_velmod_cube, sample, rtol=1e-6)
+
+
+def synthetic_models():
+    # small models with the layout of the convert.py output, covering the sampling grid
+    rng = np.random.default_rng(0)
+    units = ["N", "CK", "S", "ZE", "RO", "DC"]
+    x = np.linspace(600000.0, 630000.0, 31)
+    y = np.linspace(5760000.0, 5790000.0, 31)
+
+    # tops of the units descend, with missing values and a bottom at -infinity
+    tvd = -np.cumsum(rng.uniform(100.0, 1500.0, (y.size, x.size, len(units))), axis=2)
+    tvd[..., -1] = -np.inf
+    tvd[:3, :3, 1] = np.nan
+    dgm = xr.Dataset(
+        {
+            "tvd": (("y", "x", "unit"), tvd),
+            "ordering": ("unit", np.arange(len(units))),
+        },
+        coords={"y": y, "x": x, "unit": units},
+    )
 
-    sample = xr.load_dataset(sample_path, decode_coords="all")
+    # VELMOD lacks a unit and is defined on a shifted grid
+    velmod_units = [unit for unit in units if unit != "S"]
+    V0 = rng.uniform(1500.0, 4500.0, (y.size, x.size, len(velmod_units), 2, 2))
+    V0[-3:, -3:] = np.nan
+    velmod = xr.Dataset(
+        {
+            "V0_filled": (
+                ("y", "x", "unit", "kriging_type", "summary_statistic"),
+                V0,
+            ),
+            "k": ("unit", rng.uniform(0.0, 1.0, len(velmod_units))),
+            "ordering": ("unit", [units.index(unit) for unit in velmod_units]),
+        },
+        coords={
+            "y": y + 250.0,
+            "x": x - 250.0,
+            "unit": velmod_units,
+            "kriging_type": ["ok", "sk"],
+            "summary_statistic": ["mean", "sd"],
+        },
+    )
+
+    return (
+        dgm.rio.write_crs("epsg:23031").rio.write_coordinate_system(),
+        velmod.rio.write_crs("epsg:23031").rio.write_coordinate_system(),
+    )
+
+
+def sample_reference(x, y, z, dgm, velmod):
+    # the original implementation, interpolating all units with xarray's interp
+    sel_units = np.intersect1d(dgm["unit"], velmod["unit"])
+    velmod_itp = (
+        velmod.sel({"unit": sel_units}).interp({"x": x, "y": y}).sortby("ordering")
+    )
+    dgm_itp = dgm.sel({"unit": sel_units}).interp({"x": x, "y": y}).sortby("ordering")
+
+    V0 = velmod_itp["V0_filled"].sel(
+        {"summary_statistic": "mean", "kriging_type": "sk"}, drop=True
+    )
+    SD = velmod_itp["V0_filled"].sel(
+        {"summary_statistic": "sd", "kriging_type": "sk"}, drop=True
+    )
+    samples = xr.Dataset(
+        {
+            "V0": V0,
+            "V0_sd": SD,
+            "k": velmod_itp["k"],
+            "depth": dgm_itp["tvd"],
+            "ordering": dgm_itp["ordering"],
+        }
+    )
 
-    assert dgm_velmod_cube == sample
+    unit_vinst = V0 - velmod_itp["k"] * z
+    unit = (dgm_itp["tvd"] < z).idxmax("unit")
+    samples["unit_samples"] = unit
+    unit_mask = unit_vinst["unit"] == unit
+    samples["unit_mask"] = unit_mask
+    samples["Vinst"] = unit_vinst.where(unit_mask, 0.0).sum("unit")
+
+    return samples
+
+
+@pytest.mark.parametrize("z_type", ["index", "plain", "scalar"])
+def test_sampling_synthetic(z_type):
+    dgm, velmod = synthetic_models()
+    x_UTM, y_UTM, z = sampling_grid()
+    if z_type == "plain":
+        z = xr.DataArray(z.values, dims="z", coords={"z": z.values})
+    elif z_type == "scalar":
+        z = -1000.0
+
+    dgm_velmod_cube = sample_dgm_velmod(x_UTM, y_UTM, z, dgm=dgm, velmod=velmod)
+    reference = sample_reference(x_UTM, y_UTM, z, dgm=dgm, velmod=velmod)
+
+    # the layout (dimension order) must match as well, as for the stored sample
+    xr.testing.assert_allclose(dgm_velmod_cube, reference, rtol=1e-10)
+
+
+def test_sampling_subset():
+    dgm, velmod = synthetic_models()
+    x_UTM, y_UTM, z = sampling_grid()
+
+    # the common units stored by the convert.py script are kept when subsetting a model
+    common_units = [u for u in dgm.indexes["unit"] if u in velmod.indexes["unit"]]
+    dgm.attrs["common_units"] = common_units
+    velmod.attrs["common_units"] = common_units
+    dgm = dgm.sel({"unit": [u for u in dgm.indexes["unit"] if u != "RO"]})
+
+    dgm_velmod_cube = sample_dgm_velmod(x_UTM, y_UTM, z, dgm=dgm, velmod=velmod)
+    reference = sample_reference(x_UTM, y_UTM, z, dgm=dgm, velmod=velmod)
+
+    xr.testing.assert_allclose(dgm_velmod_cube, reference, rtol=1e-10)
+
+
+def test_sampling_orthogonal():
+    dgm, velmod = synthetic_models()
+    # off the grid nodes, where -inf times a zero weight is NaN (as for scipy)
+    x = xr.DataArray(np.linspace(605123.4, 625123.4, 9), dims="a")
+    y = xr.DataArray(np.linspace(5765432.1, 5785432.1, 7), dims="b")
+    zsmp = np.linspace(-10000.0, 0.0, 21)
+    z = xr.DataArray(zsmp, dims="z", coords={"z": zsmp})
+
+    # orthogonal samples equal the samples of all (x, y) combinations, apart from the coordinates
+    samples = sample_dgm_velmod(x, y, z, dgm=dgm, velmod=velmod)
+    points = sample_dgm_velmod(*xr.broadcast(x, y), z, dgm=dgm, velmod=velmod)
+    for name in samples.data_vars:
+        xr.testing.assert_allclose(
+            samples[name].drop_vars(["x", "y"], errors="ignore"),
+            points[name]
+            .transpose(*samples[name].dims)
+            .drop_vars(["x", "y"], errors="ignore"),
+            rtol=1e-10,
+        )
+
+    # below all other units, the deepest unit (bottom at -inf) is present
+    assert (samples["unit_samples"].sel({"z": -10000.0}) == "DC").all()